@@ -1,4 +1,4 @@
-from robyn import Robyn, ALLOW_CORS
+from robyn import Robyn, ALLOW_CORS, StreamingResponse
 from robyn.logger import logger, Colors
 import json
 import os
@@ -6,7 +6,7 @@ import os
 from contrib import register_tortoise
 from crud import query_by_url, batch_insert_videos
 
-from function import fetch_danmu_by_title
+from function import empty_danmu, fetch_episode_id, stream_danmu
 
 app = Robyn(__file__)
 app.add_response_header("content-type", "application/json")
@@ -37,10 +37,16 @@ async def get_video_info(query_params):
         return {"error": "URL参数是必需的"}, {}, 400
     result = await query_by_url(url)
     if result:
-        danmu = await fetch_danmu_by_title(
+        # 先查询剧集 ID，失败时仍按普通响应返回，不会写出半截的流
+        episode_id = await fetch_episode_id(
             result["title"], str(result["episode_index"])
         )
-        return danmu, {}, 200
+        if not episode_id:
+            return empty_danmu(result["title"]), {}, 200
+        # 分块流式返回弹幕，避免大量弹幕时整体驻留内存
+        return StreamingResponse(
+            stream_danmu(episode_id), media_type="application/json"
+        )
     else:
         return {"error": "未找到匹配的URL"}, {}, 404
 
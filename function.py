@@ -1,7 +1,11 @@
 import httpx
-from typing import Optional, Dict, List, Any
+import ijson
+import json
+from typing import Optional, Dict, List, Tuple, Any, AsyncIterator
 import os
 
+from robyn.logger import logger, Colors
+
 # 常量定义
 API_BASE_URL = os.getenv("API_BASE_URL", "")
 DEFAULT_FONT_SIZE = "25px"
@@ -37,56 +41,106 @@ async def fetch_episode_id_by_title(
     return None
 
 
-async def fetch_danmu_by_episode_id(
-    episode_id: str, client: httpx.AsyncClient
-) -> Dict[str, Any]:
-    api_url = f"{API_BASE_URL}/comment/{episode_id}"
-    response = await client.get(api_url)
-    res_data = response.json()
-    if res_data:
-        # 获取弹幕数量
-        danmu_count = res_data.get("count", 0)
-        # 批量处理弹幕内容
-        comments = res_data.get("comments", [])
-        # 使用列表推导式提高性能
-        danmu_content = [
-            parse_barrage(barrage_data)
-            for barrage_data in comments
-            if isinstance(barrage_data, dict)
-            and barrage_data.get("m")
-            and barrage_data.get("p")
-        ]
-        return {
-            "code": 1,
-            "name": episode_id,
-            "danmu": danmu_count,  # 使用实际解析成功的数量
-            "danmuku": danmu_content,
-        }
+def empty_danmu(name: str) -> Dict[str, Any]:
     return {
         "code": 0,
-        "name": episode_id,
+        "name": name,
         "danmu": 0,
         "danmuku": [],
     }
 
 
-async def fetch_danmu_by_title(title: str, episode_number: str) -> Dict[str, Any]:
+def _parse_barrages(events: List[Any]) -> Tuple[List[List[Any]], int]:
+    """解析并清空已解析出的弹幕，返回结果和因格式错误跳过的条数"""
+    danmu_content = []
+    skipped = 0
+    for barrage_data in events:
+        if (
+            isinstance(barrage_data, dict)
+            and barrage_data.get("m")
+            and barrage_data.get("p")
+        ):
+            try:
+                danmu_content.append(parse_barrage(barrage_data))
+            except (ValueError, TypeError, AttributeError):
+                # 单条弹幕格式错误时跳过，不影响整个响应
+                skipped += 1
+    del events[:]
+    return danmu_content, skipped
+
+
+def _dump_barrages(danmu_content: List[List[Any]], leading_comma: bool) -> str:
+    # 整批序列化一次，去掉外层方括号后拼接到 danmuku 数组中
+    dumped = json.dumps(danmu_content, ensure_ascii=False)[1:-1]
+    return "," + dumped if leading_comma else dumped
+
+
+async def stream_danmu_by_episode_id(
+    episode_id: str, client: httpx.AsyncClient
+) -> AsyncIterator[str]:
+    """增量解析上游 comments 数组，逐块输出 JSON，避免整体加载到内存"""
+    api_url = f"{API_BASE_URL}/comment/{episode_id}"
+    # 先确认上游可用，再开始输出，避免失败时写出半截响应
+    response: Optional[httpx.Response] = None
+    try:
+        response = await client.send(client.build_request("GET", api_url), stream=True)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.error(f"请求弹幕失败 {episode_id}: {e}", color=Colors.RED)
+        if response is not None:
+            await response.aclose()
+        yield json.dumps(empty_danmu(episode_id), ensure_ascii=False)
+        return
+    try:
+        # code 和 danmu 在读完上游后补在末尾
+        yield f'{{"name": {json.dumps(episode_id, ensure_ascii=False)}, "danmuku": ['
+        events = ijson.sendable_list()
+        # 弹幕对象由 ijson 当前后端构建，安装了 yajl2_c 时在 C 中完成
+        parser = ijson.items_coro(events, "comments.item", use_float=True)
+        # 上游正文前两个非空白字节，用于判断是否为非空对象
+        head = b""
+        danmu_count = 0
+        skipped = 0
+        ok = True
+        try:
+            async for chunk in response.aiter_bytes():
+                if len(head) < 2:
+                    head = (head + chunk.translate(None, b" \t\r\n"))[:2]
+                parser.send(chunk)
+                danmu_content, bad = _parse_barrages(events)
+                skipped += bad
+                if danmu_content:
+                    # 每个上游数据块只输出一次，减少过小的写入
+                    yield _dump_barrages(danmu_content, danmu_count > 0)
+                    danmu_count += len(danmu_content)
+            parser.close()
+        except (ijson.JSONError, ValueError, httpx.HTTPError) as e:
+            logger.error(f"解析弹幕失败 {episode_id}: {e}", color=Colors.RED)
+            ok = False
+        # 出错前已完整解析出的弹幕同样输出，结果与数据块的切分位置无关
+        danmu_content, bad = _parse_barrages(events)
+        skipped += bad
+        if danmu_content:
+            yield _dump_barrages(danmu_content, danmu_count > 0)
+            danmu_count += len(danmu_content)
+        if skipped:
+            logger.warn(f"跳过 {skipped} 条格式错误的弹幕: {episode_id}")
+        has_data = ok and head[:1] == b"{" and head != b"{}"
+        yield f'], "danmu": {danmu_count}, "code": {1 if has_data else 0}}}'
+    finally:
+        await response.aclose()
+
+
+async def fetch_episode_id(title: str, episode_number: str) -> Optional[str]:
     ## check if api_base_url is valid
     if not API_BASE_URL:
-        return {
-            "code": 0,
-            "name": title,
-            "danmu": 0,
-            "danmuku": [],
-        }
+        return None
     async with httpx.AsyncClient() as client:
-        episode_id = await fetch_episode_id_by_title(title, episode_number, client)
-        if episode_id:
-            return await fetch_danmu_by_episode_id(episode_id, client)
+        return await fetch_episode_id_by_title(title, episode_number, client)
 
-    return {
-        "code": 0,
-        "name": title,
-        "danmu": 0,
-        "danmuku": [],
-    }
+
+async def stream_danmu(episode_id: str) -> AsyncIterator[str]:
+    # 客户端需要在整个流式输出期间保持打开
+    async with httpx.AsyncClient() as client:
+        async for chunk in stream_danmu_by_episode_id(episode_id, client):
+            yield chunk